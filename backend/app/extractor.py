@@ -4,8 +4,30 @@ from typing import List, Dict
 
 # Heuristic-based extractor for menu item lines. Language-agnostic where possible.
 
-# Price / currency patterns (handles Rs, $, €, £, numbers with decimals)
-PRICE_RE = re.compile(r"(₹|Rs\.?|INR|Rs|\$|€|£)?\s*[0-9]+(?:[\.,][0-9]{1,2})?\s*(?:/-)?", re.IGNORECASE)
+# Trailing price / currency (handles Rs, $, €, £, numbers with decimals), anchored
+# at end of line so only the price after the item name is removed. Currency words
+# must not follow a letter, so "Chicken Fingers 200" keeps its "rs".
+_CURRENCY = r"(?:₹|(?<![^\W\d_])(?:Rs\.?|INR)|\$|€|£)"
+_TRAILING_PRICE_RE = re.compile(
+    rf"{_CURRENCY}?\s*\d+(?:[.,]\d{{1,2}})?\s*(?:/-|{_CURRENCY})?\s*$",
+    re.IGNORECASE,
+)
+
+# Per-line cleanup patterns, compiled once instead of on every call.
+# Leading bullets/numbers (allow common bullet chars), a wrapping "(...)" and
+# inline parenthetical notes are all removed in a single scan (substituted with
+# group 1, which only the first alternative sets). A name wrapped in parentheses,
+# optionally after a bullet and followed only by a price/separator, keeps its
+# contents: "1. (Paneer Tikka) 250" -> "Paneer Tikka 250". Any other
+# parenthetical is a note and is dropped: "(Spicy) Paneer Tikka" -> "Paneer Tikka".
+_STRIP_RE = re.compile(
+    r"^(?:[\-\u2022\*\d\)\.]+\s*)?\(([^()]*)\)(?=\s*(?:$|[-–—:|\d₹$€£]|Rs|INR))"
+    r"|^[\-\u2022\*\d\)\.]+\s*|\(.*?\)|^\(|\)$"
+)
+# byte -> 1 if it is a letter else 0, used to count ASCII letters via bytes.translate
+_LETTER_BYTES = bytes(1 if chr(i).isalpha() else 0 for i in range(256))
+# separators commonly used between name and price/desc
+_SPLIT_RE = re.compile(r"\s{2,}|\s[-–—:]\s|\s\|\s|\t")
 
 # Common section/header words (English) to filter out. These are heuristics only.
 SECTION_KEYWORDS = [
@@ -13,6 +35,8 @@ SECTION_KEYWORDS = [
     "rice", "dessert", "starters", "mains", "sides", "salads", "soups", "curries", "thali",
     "menu", "specials", "combo", "set", "kitchen"
 ]
+# All keywords as one alternation (longest first) so a line is scanned once
+_SECTION_RE = re.compile("|".join(re.escape(kw) for kw in sorted(SECTION_KEYWORDS, key=len, reverse=True)))
 
 
 def is_header_like(s: str) -> bool:
@@ -20,29 +44,30 @@ def is_header_like(s: str) -> bool:
     t = s.strip()
     if not t:
         return True
-    words = [w for w in re.split(r"\s+", t) if w]
+    words = t.split()
     if len(words) <= 4 and all((w.isupper() or w.isdigit() or len(w) <= 3) for w in words):
         return True
     # contains common section keywords
-    lower = t.lower()
-    for kw in SECTION_KEYWORDS:
-        if kw in lower:
-            return True
-    return False
+    return _SECTION_RE.search(t.lower()) is not None
 
 
 def strip_price(s: str) -> str:
-    return PRICE_RE.sub("", s).strip()
+    return _TRAILING_PRICE_RE.sub("", s, count=1).strip()
 
 
 def normalize_whitespace(s: str) -> str:
-    return re.sub(r"\s+", " ", s).strip()
+    return " ".join(s.split())
 
 
 def proportion_letters(s: str) -> float:
-    letters = sum(1 for ch in s if unicodedata.category(ch).startswith("L"))
     if not s:
         return 0.0
+    if s.isascii():
+        # fast path: map every byte to 1 (letter) or 0 and count in C
+        letters = s.encode("ascii").translate(_LETTER_BYTES).count(1)
+    else:
+        # str.isalpha covers the same Unicode L* categories
+        letters = sum(map(str.isalpha, s))
     return letters / len(s)
 
 
@@ -54,38 +79,42 @@ def extract_items(lines: List[str]) -> List[Dict]:
     candidates = []
     seen = set()
     idx = 0
+    # bind hot-loop callables to locals once
+    normalize = unicodedata.normalize
+    strip_sub = _STRIP_RE.sub
+    split_parts = _SPLIT_RE.split
+    append = candidates.append
     for raw in lines:
-        if not raw or not raw.strip():
+        if not raw:
+            continue
+        # fold compatibility forms (fullwidth, ligatures, NBSP, decomposed accents)
+        # so visually identical lines dedupe against each other
+        s = " ".join(normalize("NFKC", raw).split())
+        if not s:
             continue
-        s = raw.strip()
-        # normalize unicode spaces
-        s = normalize_whitespace(s)
         # drop obvious headers
         if is_header_like(s):
             continue
-        # remove leading bullets/numbers (allow common bullet chars)
-        s = re.sub(r"^[\-\u2022\*\d\)\.]+\s*", "", s)
-        # remove parenthetical notes at end or start
-        s = re.sub(r"^\(|\)$", "", s)
-        s = re.sub(r"\(.*?\)", "", s).strip()
-        # split on separators commonly used between name and price/desc
-        parts = re.split(r"\s{2,}|\s[-–—:]\s|\s\|\s|\t", s)
-        name_part = parts[0]
+        # remove leading bullets/numbers and parenthetical notes
+        s = strip_sub(r"\1", s).strip()
+        # split on separators commonly used between name and price/desc;
+        # only the name part is kept so stop at the first separator
+        name_part = split_parts(s, 1)[0]
         # remove trailing price tokens
-        name_part = strip_price(name_part)
-        name_part = name_part.strip(". ,:-").strip()
+        name_part = strip_price(name_part).strip(". ,:-").strip()
         if not name_part:
             continue
         # ignore lines with too many digits/punct
-        if proportion_letters(name_part) < 0.4:
+        ratio = proportion_letters(name_part)
+        if ratio < 0.4:
             # could be numeric line or address/phone
             continue
         # split comma lists into separate items if short
         if "," in name_part:
-            parts2 = [normalize_whitespace(p).strip(". ,:-") for p in name_part.split(",")]
+            parts = [normalize_whitespace(p).strip(". ,:-") for p in name_part.split(",")]
         else:
-            parts2 = [name_part]
-        for p in parts2:
+            parts = [name_part]
+        for p in parts:
             p = p.strip()
             if not p:
                 continue
@@ -94,7 +123,7 @@ def extract_items(lines: List[str]) -> List[Dict]:
                 continue
             seen.add(key)
             # heuristic score: longer than 2 chars and decent letter proportion
-            score = min(1.0, max(0.0, proportion_letters(p)))
-            candidates.append({"id": str(idx), "name": p, "original": raw, "score": round(score, 2)})
+            score = ratio if len(parts) == 1 else proportion_letters(p)
+            append({"id": str(idx), "name": p, "original": raw, "score": round(score, 2)})
             idx += 1
     return candidates
@@ -0,0 +1,20 @@
+import os
+import tempfile
+from pathlib import Path
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Write `data` to `path` so readers never see a partial file.
+
+    Writes a unique temp file in the same directory (so concurrent writers of
+    one path never share it), then renames it over `path`. The temp file is
+    removed if anything fails.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
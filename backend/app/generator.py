@@ -1,92 +1,117 @@
+import functools
 import hashlib
+import io
 import os
 import asyncio
-import aiofiles
 import logging
 import base64
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from PIL import Image as PILImage, ImageDraw, ImageFont
+from . import job_store
+from .fileutil import atomic_write_bytes
+from .hf_client import HF_OK, get_hf_client
+from .image_cache import IMAGE_CACHE, cached_path
 
 logging.basicConfig()
 logger = logging.getLogger("bmad.generator")
 logger.setLevel(logging.INFO)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
-IMAGE_CACHE = BASE_DIR / "cache" / "images"
-IMAGE_CACHE.mkdir(parents=True, exist_ok=True)
 
+# max provider calls in flight across the whole process (every job and request); set
+# via env. A job's options["concurrency"] may only lower it for that job.
+IMAGE_CONCURRENCY = max(1, int(os.getenv("IMAGE_CONCURRENCY", "4")))
+_PROVIDER_SEM = asyncio.Semaphore(IMAGE_CONCURRENCY)
 
-def _image_hash_for(text: str) -> str:
-    h = hashlib.sha256(text.encode("utf-8")).hexdigest()
-    return f"{h}.jpg"
+# JPEG encoder settings: quality 75, no extra Huffman optimization pass, 4:2:0 chroma
+# subsampling. These are Pillow's own defaults, pinned here so encode cost and file
+# size stay the same across Pillow versions.
+JPEG_SAVE_OPTIONS = {"quality": 75, "optimize": False, "subsampling": 2}
 
 
-async def remote_generate_image(prompt: str, options: Dict) -> bytes:
+@functools.lru_cache(maxsize=1)
+def _load_env() -> Dict[str, str]:
+    """Parse backend/.env once (no python-dotenv required). Returns {} on error."""
+    env = {}
+    try:
+        env_path = BASE_DIR / '.env'
+        if env_path.exists():
+            with env_path.open('r', encoding='utf-8') as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line or line.startswith('#') or '=' not in line:
+                        continue
+                    k, v = line.split('=', 1)
+                    env[k.strip()] = v.strip().strip('"').strip("'")
+    except Exception:
+        return {}
+    return env
+
+
+def _image_hash_for(*parts: str) -> str:
+    # feed parts incrementally instead of hashing a concatenated copy; the digest is
+    # the same as for "".join(parts), so existing cache filenames stay valid
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+    return f"{h.hexdigest()}.jpg"
+
+
+def _image_target(options: Dict) -> Tuple[str, str, str]:
+    """(provider, hf_provider, model) for `options`, with the defaults remote_generate_image uses."""
+    provider = options.get("provider") or "nebius"
+    hf_provider = options.get("hf_provider") or "nebius"
+    model = options.get("model") or "black-forest-labs/FLUX.1-dev"
+    return provider, hf_provider, model
+
+
+async def remote_generate_image(prompt: str, options: Dict) -> Tuple[bytes, bool]:
     """Generate image bytes using configured provider. Options may include:
     { provider: 'nebius'|'openai', api_key, model, hf_provider }
+
+    Returns (image_bytes, ok). `ok` is False when the provider call failed or is
+    unavailable and a placeholder image was returned instead; callers must not
+    cache those bytes as the result for `prompt`.
     """
-    provider = options.get("provider", "nebius")
+    provider, hf_provider, hf_model = _image_target(options)
     api_key = options.get("api_key") or os.getenv("HF_TOKEN") or os.getenv("IMAGE_API_KEY")
-    # If api_key still missing, try to read backend/.env manually (no python-dotenv required)
+    # If api_key still missing, fall back to values parsed from backend/.env
     if not api_key:
-        try:
-            env_path = BASE_DIR / '.env'
-            if env_path.exists():
-                with env_path.open('r', encoding='utf-8') as fh:
-                    for line in fh:
-                        line = line.strip()
-                        if not line or line.startswith('#') or '=' not in line:
-                            continue
-                        k, v = line.split('=', 1)
-                        k = k.strip(); v = v.strip().strip('"').strip("'")
-                        if k == 'HF_TOKEN' or k == 'IMAGE_API_KEY':
-                            api_key = v
-                            break
-        except Exception:
-            pass
-    model = options.get("model")
+        env = _load_env()
+        api_key = env.get("HF_TOKEN") or env.get("IMAGE_API_KEY")
 
     # Use Hugging Face InferenceClient for text-to-image generation
     if provider == "nebius":
-        try:
-            from huggingface_hub import InferenceClient
-            from PIL import Image
-            import io
-        except Exception:
-            logger.exception("Required libraries for HF image generation missing; using placeholder")
-            return _placeholder_image_bytes(prompt)
-
-        # default to 'nebius' provider and FLUX model if not provided
-        hf_provider = options.get("hf_provider") or "nebius"
-        hf_model = model or options.get("model") or "black-forest-labs/FLUX.1-dev"
+        if not HF_OK:
+            logger.warning("huggingface-hub not installed; using placeholder image")
+            return _placeholder_image_bytes(prompt), False
 
         def hf_call():
-            client = InferenceClient(api_key=api_key, provider=hf_provider)
+            client = get_hf_client(api_key, hf_provider)
             # call once; callers may return PIL Image, bytes, base64 string, dict, etc.
             return client.text_to_image(prompt, model=hf_model)
 
         try:
-            img_resp = await asyncio.to_thread(hf_call)
+            async with _PROVIDER_SEM:
+                img_resp = await asyncio.to_thread(hf_call)
         except Exception:
             logger.exception("HF text_to_image call failed; returning placeholder image")
-            return _placeholder_image_bytes(prompt)
+            return _placeholder_image_bytes(prompt), False
 
         # Normalize response into bytes
         # If already bytes
         if isinstance(img_resp, (bytes, bytearray)):
-            return bytes(img_resp)
+            return bytes(img_resp), True
 
         # If PIL Image
-        try:
-            from PIL import Image as PILImage
-            import io as _io
-            if isinstance(img_resp, PILImage.Image):
-                buf = _io.BytesIO()
-                img_resp.save(buf, format="JPEG")
-                return buf.getvalue()
-        except Exception:
-            # not a PIL Image
-            pass
+        if isinstance(img_resp, PILImage.Image):
+            try:
+                buf = io.BytesIO()
+                img_resp.save(buf, format="JPEG", **JPEG_SAVE_OPTIONS)
+                return buf.getvalue(), True
+            except Exception:
+                logger.exception("Could not encode HF image response as JPEG")
 
         # If string, maybe base64
         if isinstance(img_resp, str):
@@ -96,7 +121,7 @@ async def remote_generate_image(prompt: str, options: Dict) -> bytes:
                 b = base64.b64decode(s, validate=True)
                 # basic sanity: must start with JPEG magic
                 if b[:2] == b"\xff\xd8":
-                    return b
+                    return b, True
             except Exception:
                 pass
 
@@ -107,61 +132,107 @@ async def remote_generate_image(prompt: str, options: Dict) -> bytes:
                 if key in img_resp:
                     val = img_resp[key]
                     if isinstance(val, (bytes, bytearray)):
-                        return bytes(val)
+                        return bytes(val), True
                     if isinstance(val, str):
                         try:
                             b = base64.b64decode(val)
                             if b[:2] == b"\xff\xd8":
-                                return b
+                                return b, True
                         except Exception:
                             continue
 
         # Could not normalize; log and return placeholder
         logger.warning("HF response could not be converted to image bytes; type=%s", type(img_resp))
-        return _placeholder_image_bytes(prompt)
+        return _placeholder_image_bytes(prompt), False
 
 
     # other providers: return placeholder
-    return _placeholder_image_bytes(prompt)
+    return _placeholder_image_bytes(prompt), False
 
 
 def _placeholder_image_bytes(prompt: str) -> bytes:
-    from PIL import Image, ImageDraw, ImageFont
-    import io
-    img = Image.new("RGB", (640, 480), color=(240, 240, 240))
-    d = ImageDraw.Draw(img)
+    return _placeholder_jpeg(prompt[:200])
+
+
+def placeholder_filename(prompt: str) -> str:
+    """Cache filename for the placeholder of `prompt`, distinct from any real image's name."""
+    return "placeholder_" + _image_hash_for(prompt[:200])
+
+
+@functools.lru_cache(maxsize=1)
+def _placeholder_base():
+    """Blank canvas and default font, loaded once and shared by all placeholders."""
+    img = PILImage.new("RGB", (640, 480), color=(240, 240, 240))
     try:
-        f = ImageFont.load_default()
-        d.text((10, 10), prompt[:200], fill=(10, 10, 10), font=f)
+        font = ImageFont.load_default()
     except Exception:
-        d.text((10, 10), prompt[:200], fill=(10, 10, 10))
+        font = None
+    return img, font
+
+
+@functools.lru_cache(maxsize=64)
+def _placeholder_jpeg(text: str) -> bytes:
+    base, font = _placeholder_base()
+    img = base.copy()
+    d = ImageDraw.Draw(img)
+    if font is not None:
+        d.text((10, 10), text, fill=(10, 10, 10), font=font)
+    else:
+        d.text((10, 10), text, fill=(10, 10, 10))
     buf = io.BytesIO()
-    img.save(buf, format="JPEG")
+    img.save(buf, format="JPEG", **JPEG_SAVE_OPTIONS)
     return buf.getvalue()
 
 
 async def enqueue_generation(job_id: str, item_id: str, item_text: str, options: Dict):
     # Compose prompt (if prompt provided in options use it)
     prompt = options.get("prompt") or f"Photorealistic food photography of {item_text}, plated, high detail, natural lighting, shallow depth of field, appetizing"
-    img_bytes = await remote_generate_image(prompt, options)
-    filename = _image_hash_for(item_text + prompt)
-    path = IMAGE_CACHE / filename
-    async with aiofiles.open(path, "wb") as f:
-        await f.write(img_bytes)
-    # update in-memory job store
+    # same content-addressed name as /api/generate_images, keyed on provider/model too,
+    # so an existing file means this prompt was already generated with the requested
+    # model; `force` (set by regenerate) asks for a fresh image regardless
+    path = cached_path(*_image_target(options), prompt)
+    filename = path.name
+    if options.get("force") or not path.exists():
+        img_bytes, ok = await remote_generate_image(prompt, options)
+        if not ok:
+            # keep placeholders out of the deterministic name, or they would count as
+            # a generated image for every later job with this item and prompt
+            filename = placeholder_filename(prompt)
+            path = IMAGE_CACHE / filename
+        await asyncio.to_thread(atomic_write_bytes, path, img_bytes)
+    # update shared job store
     try:
-        from .main import JOBS
-        job = JOBS.get(job_id)
-        if job:
-            job.setdefault("results", {})[item_id] = filename
-            for it in job.get("items", []):
-                if it["id"] == item_id:
-                    it["status"] = "done"
-            if all(it.get("status") == "done" for it in job.get("items", [])):
-                job["status"] = "completed"
+        await job_store.patch_item(job_id, item_id, {"status": "done"}, result=filename)
     except Exception:
-        pass
+        logger.exception("Failed to update job=%s item=%s", job_id, item_id)
+
+
+def _batch_concurrency(options: Dict) -> int:
+    """Client-supplied options["concurrency"], clamped to 1..IMAGE_CONCURRENCY."""
+    try:
+        n = int(options.get("concurrency") or IMAGE_CONCURRENCY)
+    except (TypeError, ValueError):
+        n = IMAGE_CONCURRENCY
+    return max(1, min(n, IMAGE_CONCURRENCY))
+
+
+async def enqueue_generation_batch(job_id: str, items: List[Dict], options: Dict):
+    """Generate images for all `items` ({id, text}) of a job concurrently.
+
+    At most `options["concurrency"]` (clamped to 1..IMAGE_CONCURRENCY, the default) provider
+    calls are in flight at once.
+    """
+    sem = asyncio.Semaphore(_batch_concurrency(options))
+
+    async def one(it: Dict):
+        async with sem:
+            await enqueue_generation(job_id, it["id"], it["text"], options)
+
+    results = await asyncio.gather(*(one(it) for it in items), return_exceptions=True)
+    for it, res in zip(items, results):
+        if isinstance(res, Exception):
+            logger.error("Image generation failed for job=%s item=%s: %s", job_id, it["id"], res)
 
 
-def get_job_status(job_id: str, JOBS: dict):
-    return JOBS.get(job_id)
+async def get_job_status(job_id: str):
+    return await job_store.get(job_id)
@@ -0,0 +1,16 @@
+import functools
+from typing import Optional
+
+# Optional huggingface-hub dependency, shared by the image generator and the LLM
+# parser so both use one client cache.
+try:
+    from huggingface_hub import InferenceClient
+    HF_OK = True
+except Exception:
+    HF_OK = False
+
+
+@functools.lru_cache(maxsize=8)
+def get_hf_client(api_key: str, provider: Optional[str] = None):
+    """Return a shared InferenceClient per (api_key, provider) so its HTTP session is reused."""
+    return InferenceClient(api_key=api_key, provider=provider)
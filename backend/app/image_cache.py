@@ -0,0 +1,19 @@
+import functools
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+IMAGE_CACHE = BASE_DIR / "cache" / "images"
+IMAGE_CACHE.mkdir(parents=True, exist_ok=True)
+
+# Content-addressed lookup for generated images: the same prompt sent to the
+# same provider/HF provider/model maps to the same file, so it is only generated once.
+# Used by both /api/generate_images and confirmed jobs. Only real provider output
+# may be stored here (never placeholders).
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_path(provider: Optional[str], hf_provider: Optional[str], model: Optional[str], prompt: str) -> Path:
+    h = hashlib.sha256(f"{provider}|{hf_provider}|{model}|{prompt}".encode("utf-8")).hexdigest()
+    return IMAGE_CACHE / f"{h}.jpg"
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Optional
+
+# Job documents shared by all uvicorn workers: Redis when REDIS_URL is set (and
+# the `redis` package is installed), otherwise a SQLite file under cache/.
+# Documents look like {status, items: [{id, text, status}], results: {item_id: filename}}.
+# The same backend holds the upload index: sha256 of uploaded bytes -> upload
+# response, keeping the UPLOAD_INDEX_MAX most recently used entries.
+
+logging.basicConfig()
+logger = logging.getLogger("bmad.jobs")
+logger.setLevel(logging.INFO)
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+JOBS_DB = BASE_DIR / "cache" / "jobs.sqlite3"
+DEFAULT_TTL = 86400
+UPLOAD_INDEX_MAX = 1000
+
+
+def _apply_patch(doc: Dict, item_id: str, fields: Dict, result: Optional[str]) -> Optional[Dict]:
+    item = next((i for i in doc.get("items", []) if i["id"] == item_id), None)
+    if item is None:
+        return None
+    item.update(fields)
+    if result is not None:
+        doc.setdefault("results", {})[item_id] = result
+    if all(it.get("status") == "done" for it in doc.get("items", [])):
+        doc["status"] = "completed"
+    return doc
+
+
+class _SqliteStore:
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, doc TEXT NOT NULL, expires_at INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS uploads (digest TEXT PRIMARY KEY, doc TEXT NOT NULL, used_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS uploads_used_at ON uploads (used_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # one short-lived connection per call; calls run on worker threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _get(self, job_id: str) -> Optional[Dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT doc FROM jobs WHERE id = ? AND expires_at > ?", (job_id, int(time.time()))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, job_id: str, doc: Dict, ttl: int):
+        now = int(time.time())
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+            conn.execute("INSERT OR REPLACE INTO jobs (id, doc, expires_at) VALUES (?, ?, ?)", (job_id, json.dumps(doc), now + ttl))
+
+    def _patch_item(self, job_id: str, item_id: str, fields: Dict, result: Optional[str]) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            # take the write lock before reading so concurrent patches serialize
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT doc FROM jobs WHERE id = ? AND expires_at > ?", (job_id, int(time.time()))).fetchone()
+            doc = _apply_patch(json.loads(row[0]), item_id, fields, result) if row else None
+            if doc is not None:
+                conn.execute("UPDATE jobs SET doc = ? WHERE id = ?", (json.dumps(doc), job_id))
+            conn.execute("COMMIT")
+            return doc
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _get_upload(self, digest: str) -> Optional[Dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT doc FROM uploads WHERE digest = ?", (digest,)).fetchone()
+            if row:
+                conn.execute("UPDATE uploads SET used_at = ? WHERE digest = ?", (time.time(), digest))
+        return json.loads(row[0]) if row else None
+
+    def _put_upload(self, digest: str, doc: Dict, max_entries: int):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO uploads (digest, doc, used_at) VALUES (?, ?, ?)", (digest, json.dumps(doc), time.time()))
+            conn.execute(
+                "DELETE FROM uploads WHERE digest NOT IN (SELECT digest FROM uploads ORDER BY used_at DESC LIMIT ?)",
+                (max_entries,),
+            )
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def set(self, job_id: str, doc: Dict, ttl: int = DEFAULT_TTL):
+        await asyncio.to_thread(self._set, job_id, doc, ttl)
+
+    async def patch_item(self, job_id: str, item_id: str, fields: Dict, result: Optional[str] = None) -> Optional[Dict]:
+        return await asyncio.to_thread(self._patch_item, job_id, item_id, fields, result)
+
+    async def get_upload(self, digest: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self._get_upload, digest)
+
+    async def put_upload(self, digest: str, doc: Dict, max_entries: int):
+        await asyncio.to_thread(self._put_upload, digest, doc, max_entries)
+
+
+class _RedisStore:
+    def __init__(self, url: str):
+        from redis.asyncio import Redis
+        self.redis = Redis.from_url(url)
+
+    # upload documents live under _upload_key; a sorted set scores digests by last use
+    _UPLOADS_LRU = "menuai:uploads"
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"menuai:job:{job_id}"
+
+    @staticmethod
+    def _upload_key(digest: str) -> str:
+        return f"menuai:upload:{digest}"
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        raw = await self.redis.get(self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    async def set(self, job_id: str, doc: Dict, ttl: int = DEFAULT_TTL):
+        await self.redis.set(self._key(job_id), json.dumps(doc), ex=ttl)
+
+    async def patch_item(self, job_id: str, item_id: str, fields: Dict, result: Optional[str] = None) -> Optional[Dict]:
+        from redis.exceptions import WatchError
+        key = self._key(job_id)
+        async with self.redis.pipeline() as pipe:
+            # optimistic transaction: retry if another worker changed the job meanwhile
+            while True:
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    doc = _apply_patch(json.loads(raw), item_id, fields, result) if raw else None
+                    if doc is None:
+                        await pipe.unwatch()
+                        return None
+                    ttl = await pipe.ttl(key)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(doc), ex=ttl if ttl > 0 else DEFAULT_TTL)
+                    await pipe.execute()
+                    return doc
+                except WatchError:
+                    continue
+
+    async def get_upload(self, digest: str) -> Optional[Dict]:
+        raw = await self.redis.get(self._upload_key(digest))
+        if not raw:
+            return None
+        await self.redis.zadd(self._UPLOADS_LRU, {digest: time.time()})
+        return json.loads(raw)
+
+    async def put_upload(self, digest: str, doc: Dict, max_entries: int):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._upload_key(digest), json.dumps(doc))
+            pipe.zadd(self._UPLOADS_LRU, {digest: time.time()})
+            await pipe.execute()
+        # evict the least recently used digests beyond max_entries
+        stale = await self.redis.zrange(self._UPLOADS_LRU, 0, -(max_entries + 1))
+        if stale:
+            await self.redis.delete(*(self._upload_key(d.decode()) for d in stale))
+            await self.redis.zrem(self._UPLOADS_LRU, *stale)
+
+
+def _make_store():
+    url = os.getenv("REDIS_URL")
+    if url:
+        try:
+            return _RedisStore(url)
+        except ImportError:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using SQLite job store")
+    return _SqliteStore(JOBS_DB)
+
+
+_store = _make_store()
+
+
+async def get(job_id: str) -> Optional[Dict]:
+    return await _store.get(job_id)
+
+
+async def set(job_id: str, doc: Dict, ttl: int = DEFAULT_TTL):
+    await _store.set(job_id, doc, ttl)
+
+
+async def patch_item(job_id: str, item_id: str, fields: Dict, result: Optional[str] = None) -> Optional[Dict]:
+    """Update one item of a job (and its result filename) atomically.
+
+    Marks the job completed once every item is done. Returns the updated
+    document, or None if the job or item does not exist.
+    """
+    return await _store.patch_item(job_id, item_id, fields, result)
+
+
+async def get_upload(digest: str) -> Optional[Dict]:
+    """Return the stored upload response for `digest` (sha256 of the file), marking it recently used."""
+    return await _store.get_upload(digest)
+
+
+async def put_upload(digest: str, doc: Dict, max_entries: int = UPLOAD_INDEX_MAX):
+    """Store the upload response for `digest`, evicting the least recently used beyond `max_entries`."""
+    await _store.put_upload(digest, doc, max_entries)
@@ -1,7 +1,15 @@
+import hashlib
 import httpx
+import json
+import os
 import asyncio
 import logging
-from typing import List
+import aiofiles
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+from .fileutil import atomic_write_bytes
+from .hf_client import HF_OK, get_hf_client
 
 # basic logger for LLM requests
 logging.basicConfig()
@@ -13,9 +21,136 @@ def _mask_key(key: str):
         return None
     return (key[:4] + "..." + key[-4:]) if len(key) > 8 else (key[:2] + "...")
 
+BASE_DIR = Path(__file__).resolve().parents[1]
+LLM_CACHE = BASE_DIR / "cache" / "llm"
+LLM_CACHE.mkdir(parents=True, exist_ok=True)
+
 OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
 HUGGINGFACE_INFERENCE_URL = "https://router.huggingface.co/v1/models"
 
+# shared client so keep-alive connections are reused across LLM requests; the
+# app's lifespan creates it on startup (open_http_client) and closes it on shutdown
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def open_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it if there is none or it was closed."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# LRU memo of parse_and_describe results keyed by sha256(provider|model|text)
+_LLM_CACHE: "OrderedDict[str, List[Dict]]" = OrderedDict()
+_LLM_CACHE_MAXSIZE = 256
+
+
+def _llm_cache_key(provider: str, model: str, text: str) -> str:
+    return hashlib.sha256(f"{provider}|{model}|{text}".encode("utf-8")).hexdigest()
+
+
+def _llm_cache_get(key: str) -> Optional[List[Dict]]:
+    out = _LLM_CACHE.get(key)
+    if out is None:
+        return None
+    _LLM_CACHE.move_to_end(key)
+    return [dict(o) for o in out]
+
+
+def _llm_cache_put(key: str, out: List[Dict]):
+    _LLM_CACHE[key] = [dict(o) for o in out]
+    _LLM_CACHE.move_to_end(key)
+    while len(_LLM_CACHE) > _LLM_CACHE_MAXSIZE:
+        _LLM_CACHE.popitem(last=False)
+
+
+async def _llm_disk_get(key: str) -> Optional[List[Dict]]:
+    path = LLM_CACHE / f"{key}.json"
+    if not path.exists():
+        return None
+    try:
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            return json.loads(await f.read())
+    except Exception:
+        logger.warning("Ignoring unreadable LLM cache entry %s", path.name)
+        return None
+
+
+async def _llm_disk_put(key: str, out: List[Dict]):
+    path = LLM_CACHE / f"{key}.json"
+    try:
+        data = json.dumps(out, ensure_ascii=False).encode("utf-8")
+        await asyncio.to_thread(atomic_write_bytes, path, data)
+    except Exception:
+        logger.exception("Failed to write LLM cache entry %s", path.name)
+
+
+# Large menus are split into bins of at most LLM_BATCH lines, sent concurrently (bounded),
+# so one huge prompt is not truncated or slowed down by the provider
+LLM_BATCH = max(1, int(os.getenv("LLM_BATCH", "32")))
+
+
+def _batches(lines: List[str]) -> List[List[str]]:
+    return [lines[i:i + LLM_BATCH] for i in range(0, len(lines), LLM_BATCH)] or [lines]
+
+
+# at most LLM_CONCURRENCY bins in flight across the process, to stay under provider rate limits
+LLM_CONCURRENCY = max(1, int(os.getenv("LLM_CONCURRENCY", "4")))
+_LLM_SEM = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+async def _gather_bins(fn, bins: List[List[str]], *args, **kwargs) -> list:
+    """Run `fn` on each bin under _LLM_SEM and return the concatenated results in order.
+
+    If one bin fails the remaining ones are cancelled, so they stop spending
+    tokens, and the error is raised.
+    """
+    async def one(b: List[str]):
+        async with _LLM_SEM:
+            return await fn(b, *args, **kwargs)
+
+    tasks = [asyncio.ensure_future(one(b)) for b in bins]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [x for r in results for x in r]
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _extract_json_array(content: str) -> Optional[list]:
+    """Return the first JSON array embedded in `content`, or None.
+
+    Decodes in place from each '[' with raw_decode, which stops at the end of
+    the array, so stray brackets in surrounding prose do not break parsing.
+    """
+    i = content.find("[")
+    while i != -1:
+        try:
+            arr, _ = _JSON_DECODER.raw_decode(content, i)
+            if isinstance(arr, list):
+                return arr
+        except ValueError:
+            pass
+        i = content.find("[", i + 1)
+    return None
+
 
 async def parse_with_llm(lines: List[str], api_key: str, model: str = "gpt-3.5-turbo", provider: str = "openai") -> List[str]:
     """Extract menu items using a remote LLM provider. Supports 'openai' and 'huggingface'.
@@ -25,6 +160,10 @@ async def parse_with_llm(lines: List[str], api_key: str, model: str = "gpt-3.5-t
     if not api_key:
         raise ValueError("API key required for LLM parsing")
 
+    bins = _batches(lines)
+    if len(bins) > 1:
+        return await _gather_bins(parse_with_llm, bins, api_key, model=model, provider=provider)
+
     text = "\n".join(lines)
     prompt = (
         f"Extract probable food menu item names from the following noisy OCR output. "
@@ -41,14 +180,12 @@ async def parse_with_llm(lines: List[str], api_key: str, model: str = "gpt-3.5-t
 
     # Use Hugging Face official client when provider is 'huggingface' to improve compatibility
     if provider == "huggingface":
-        try:
-            from huggingface_hub import InferenceClient
-        except Exception as e:
+        if not HF_OK:
             raise RuntimeError("huggingface-hub library not installed; add it to requirements.txt")
 
         def hf_call():
             # run in thread to avoid blocking async loop
-            client = InferenceClient(api_key=api_key)
+            client = get_hf_client(api_key)
             # Try chat completions (if model supports chat). Fall back to text_generation.
             try:
                 completion = client.chat.completions.create(
@@ -81,37 +218,28 @@ async def parse_with_llm(lines: List[str], api_key: str, model: str = "gpt-3.5-t
         content = await asyncio.to_thread(hf_call)
 
     else:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            payload = {
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": "You extract menu item names from OCR output."},
-                    {"role": "user", "content": prompt},
-                ],
-                "temperature": 0.0,
-                "max_tokens": 512,
-            }
-            r = await client.post(OPENAI_CHAT_URL, json=payload, headers=headers)
-            r.raise_for_status()
-            data = r.json()
-            try:
-                content = data["choices"][0]["message"]["content"]
-            except Exception:
-                content = data["choices"][0].get("text", "")
-
-    # Try to extract a JSON array from the model output
-    import json
-
-    start = content.find("[")
-    end = content.rfind("]")
-    if start != -1 and end != -1 and end > start:
-        snippet = content[start : end + 1]
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": "You extract menu item names from OCR output."},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": 0.0,
+            "max_tokens": 512,
+        }
+        r = await open_http_client().post(OPENAI_CHAT_URL, json=payload, headers=headers)
+        r.raise_for_status()
+        data = r.json()
         try:
-            arr = json.loads(snippet)
-            return [str(x).strip() for x in arr if str(x).strip()]
+            content = data["choices"][0]["message"]["content"]
         except Exception:
-            pass
+            content = data["choices"][0].get("text", "")
+
+    # Try to extract a JSON array from the model output
+    arr = _extract_json_array(content)
+    if arr is not None:
+        return [str(x).strip() for x in arr if str(x).strip()]
 
     # Fallback: lines from content
     lines_out = [l.strip() for l in content.splitlines() if l.strip()]
@@ -150,7 +278,21 @@ async def parse_and_describe(lines: List[str], api_key: str, model: str = "gpt-3
     if not api_key:
         raise ValueError("API key required for LLM parsing")
 
+    bins = _batches(lines)
+    if len(bins) > 1:
+        return await _gather_bins(parse_and_describe, bins, api_key, model=model, provider=provider)
+
     text = "\n".join(lines)
+    # identical menus (re-uploads, retries) are served from memory or cache/llm
+    # instead of another LLM round-trip
+    cache_key = _llm_cache_key(provider, model, text)
+    cached = _llm_cache_get(cache_key)
+    if cached is None:
+        cached = await _llm_disk_get(cache_key)
+        if cached is not None:
+            _llm_cache_put(cache_key, cached)
+    if cached is not None:
+        return cached
     instruction = (
         "Extract probable food menu item names from the following noisy OCR output. "
         "For each item return an object with keys: 'name', 'description', and 'prompt'. "
@@ -164,13 +306,11 @@ async def parse_and_describe(lines: List[str], api_key: str, model: str = "gpt-3
 
     # HuggingFace path
     if provider == "huggingface":
-        try:
-            from huggingface_hub import InferenceClient
-        except Exception:
+        if not HF_OK:
             raise RuntimeError("huggingface-hub library not installed; add it to requirements.txt")
 
         def hf_call():
-            client = InferenceClient(api_key=api_key)
+            client = get_hf_client(api_key)
             try:
                 completion = client.chat.completions.create(model=model, messages=[{"role": "user", "content": instruction}])
                 c0 = completion.choices[0]
@@ -191,42 +331,36 @@ async def parse_and_describe(lines: List[str], api_key: str, model: str = "gpt-3
 
         content = await asyncio.to_thread(hf_call)
     else:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            payload = {
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": "You extract menu items and generate descriptions/prompts in JSON."},
-                    {"role": "user", "content": instruction},
-                ],
-                "temperature": 0.0,
-                "max_tokens": 1024,
-            }
-            r = await client.post(OPENAI_CHAT_URL, json=payload, headers=headers)
-            r.raise_for_status()
-            data = r.json()
-            try:
-                content = data["choices"][0]["message"]["content"]
-            except Exception:
-                content = data["choices"][0].get("text", "")
-
-    # extract JSON array
-    import json
-    start = content.find("[")
-    end = content.rfind("]")
-    if start != -1 and end != -1 and end > start:
-        snippet = content[start:end+1]
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": "You extract menu items and generate descriptions/prompts in JSON."},
+                {"role": "user", "content": instruction},
+            ],
+            "temperature": 0.0,
+            "max_tokens": 1024,
+        }
+        r = await open_http_client().post(OPENAI_CHAT_URL, json=payload, headers=headers)
+        r.raise_for_status()
+        data = r.json()
         try:
-            arr = json.loads(snippet)
-            out = []
-            for obj in arr:
-                name = obj.get('name') if isinstance(obj, dict) else None
-                desc = obj.get('description') if isinstance(obj, dict) else None
-                prompt = obj.get('prompt') if isinstance(obj, dict) else None
-                out.append({'name': name or '', 'description': desc or '', 'prompt': prompt or ''})
-            return out
+            content = data["choices"][0]["message"]["content"]
         except Exception:
-            pass
+            content = data["choices"][0].get("text", "")
+
+    # extract JSON array
+    arr = _extract_json_array(content)
+    if arr is not None:
+        out = []
+        for obj in arr:
+            name = obj.get('name') if isinstance(obj, dict) else None
+            desc = obj.get('description') if isinstance(obj, dict) else None
+            prompt = obj.get('prompt') if isinstance(obj, dict) else None
+            out.append({'name': name or '', 'description': desc or '', 'prompt': prompt or ''})
+        _llm_cache_put(cache_key, out)
+        await _llm_disk_put(cache_key, out)
+        return out
 
     # Fallback: build objects from lines
     out = []
@@ -1,59 +1,127 @@
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Request
+from fastapi.responses import ORJSONResponse, FileResponse, Response
 from pathlib import Path
+import hashlib
+import os
 import uuid
-import shutil
 import asyncio
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from .ocr import ocr_from_image
+from .ocr import init_worker, ocr_from_image_cached
 from .parser import parse_lines
-from .generator import enqueue_generation, get_job_status, remote_generate_image
+from .generator import (
+    enqueue_generation, enqueue_generation_batch, get_job_status, placeholder_filename,
+    remote_generate_image,
+)
+from . import job_store
 import aiofiles
 from .extractor import extract_items
-from .llm_parser import parse_with_llm, parse_and_describe
+from .fileutil import atomic_write_bytes
+from .image_cache import cached_path
+from .llm_parser import close_http_client, open_http_client, parse_with_llm, parse_and_describe
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 UPLOAD_DIR = BASE_DIR / "uploads"
 IMAGE_CACHE = BASE_DIR / "cache" / "images"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 IMAGE_CACHE.mkdir(parents=True, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+logging.basicConfig()
+logger = logging.getLogger("bmad.main")
+logger.setLevel(logging.INFO)
 
 # Load .env for local development (explicitly load `backend/.env` so HF_TOKEN is available)
 load_dotenv(dotenv_path=BASE_DIR / '.env')
 
-app = FastAPI(title="Menu AI Backend")
+# Server-side API key fallbacks, resolved once after .env is loaded
+SERVER_HF = os.getenv('HF_TOKEN') or os.getenv('HUGGINGFACE_API_KEY') or os.getenv('HUGGINGFACE_TOKEN')
+SERVER_OPENAI = os.getenv('OPENAI_API_KEY') or os.getenv('OPENAI_APIKEY')
+SERVER_LLM_KEY = os.getenv('IMAGE_API_KEY') or SERVER_OPENAI or SERVER_HF
+
+# OCR worker processes per server process
+OCR_WORKERS = int(os.getenv("OCR_WORKERS") or os.cpu_count() or 1)
+
+
+def _make_ocr_pool() -> ProcessPoolExecutor:
+    # separate processes sidestep the GIL for OpenCV/numpy preprocessing and in-process OCR.
+    # Workers are started with forkserver/spawn, never fork: this process already runs
+    # the event loop and worker threads, which forked children could deadlock on.
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=ctx, initializer=init_worker)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # created here rather than at import so each startup gets a fresh, open client and pool
+    open_http_client()
+    app.state.ocr_pool = _make_ocr_pool()
+    yield
+    app.state.ocr_pool.shutdown(wait=False, cancel_futures=True)
+    # finish writing generated images that were already returned to clients
+    await asyncio.gather(*list(_PENDING_WRITES.values()))
+    # release pooled keep-alive connections on shutdown
+    await close_http_client()
 
-# Simple in-memory stores (for prototype)
-JOBS = {}
+
+# orjson serializes large candidate lists much faster than the stdlib encoder
+app = FastAPI(title="Menu AI Backend", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 @app.post("/api/upload")
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(request: Request, file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename")
     temp_id = str(uuid.uuid4())
     dest = UPLOAD_DIR / f"{temp_id}_{file.filename}"
-    with dest.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # stream to disk in chunks without blocking the event loop, hashing as we go
+    digest = hashlib.sha256()
+    async with aiofiles.open(dest, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            await f.write(chunk)
+
+    h = digest.hexdigest()
+
+    # identical file uploaded recently (e.g. a UI retry): reuse its result, skip OCR
+    hit = await job_store.get_upload(h)
+    if hit is not None:
+        dest.unlink(missing_ok=True)
+        return hit
+    # keep one copy per content on disk
+    final = UPLOAD_DIR / f"{h}_{file.filename}"
+    os.replace(dest, final)
 
-    # Run OCR (sync) — keep it simple for prototype
-    lines = ocr_from_image(str(dest))
-    candidates = parse_lines(lines)
-    return JSONResponse({"job_text_id": temp_id, "candidates": candidates})
+    # OCR is CPU-bound; run it in the process pool so concurrent uploads use all cores
+    # (cached by file content)
+    loop = asyncio.get_running_loop()
+    lines = await loop.run_in_executor(request.app.state.ocr_pool, ocr_from_image_cached, str(final), h)
+    candidates = await asyncio.to_thread(parse_lines, lines)
+    result = {"job_text_id": temp_id, "candidates": candidates}
+    await job_store.put_upload(h, result)
+    return result
 
 @app.post("/api/confirm")
 async def confirm_items(payload: dict, background_tasks: BackgroundTasks):
     # payload: { "job_text_id": "...", "items": [{"id": "...", "text": "..."}], "options": {...} }
     job_id = str(uuid.uuid4())
-    JOBS[job_id] = {"status": "queued", "items": [], "results": {}}
+    job = {"status": "queued", "items": [], "results": {}}
     items = payload.get("items", [])
     options = payload.get("options", {})
-    # enqueue generation tasks
+    batch = []
     for item in items:
         item_id = item.get("id") or str(uuid.uuid4())
         text = item.get("text")
-        JOBS[job_id]["items"].append({"id": item_id, "text": text, "status": "pending"})
-        background_tasks.add_task(enqueue_generation, job_id, item_id, text, options)
-    JOBS[job_id]["status"] = "running"
+        job["items"].append({"id": item_id, "text": text, "status": "pending"})
+        batch.append({"id": item_id, "text": text})
+    job["status"] = "running"
+    await job_store.set(job_id, job)
+    # one background task fans the items out concurrently
+    background_tasks.add_task(enqueue_generation_batch, job_id, batch, options)
     return {"job_id": job_id}
 
 
@@ -78,12 +146,9 @@ async def api_clean_items(payload: dict):
         raise HTTPException(status_code=400, detail="`lines` must be a list of strings")
     # merge with sensible defaults (allow frontend to omit provider/model/api keys)
     options = payload.get("options", {}) or {}
-    import os
-    server_hf = os.getenv('HF_TOKEN') or os.getenv('HUGGINGFACE_API_KEY') or os.getenv('HUGGINGFACE_TOKEN')
-    server_openai = os.getenv('OPENAI_API_KEY') or os.getenv('OPENAI_APIKEY')
     defaults = {
         'use_llm': False,
-        'api_key': server_hf or server_openai,
+        'api_key': SERVER_HF or SERVER_OPENAI,
         'provider': 'huggingface',
         'model': 'openai/gpt-oss-20b',
     }
@@ -98,17 +163,7 @@ async def api_clean_items(payload: dict):
     include_descriptions = bool(options.get('include_descriptions'))
     if use_llm:
         # allow server env variable fallback; check common env names for OpenAI/HuggingFace
-        import os
-
-        server_key = (
-            os.getenv("IMAGE_API_KEY")
-            or os.getenv("OPENAI_API_KEY")
-            or os.getenv("OPENAI_APIKEY")
-            or os.getenv("HF_TOKEN")
-            or os.getenv("HUGGINGFACE_API_KEY")
-            or os.getenv("HUGGINGFACE_TOKEN")
-        )
-        key = api_key or server_key
+        key = api_key or SERVER_LLM_KEY
         if not key:
             raise HTTPException(status_code=400, detail="LLM parsing requested but no API key provided on server or in request")
         try:
@@ -126,7 +181,7 @@ async def api_clean_items(payload: dict):
 
 @app.get("/api/job/{job_id}")
 async def job_status(job_id: str):
-    job = JOBS.get(job_id)
+    job = await job_store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     # attach image URLs where available
@@ -143,7 +198,7 @@ async def job_status(job_id: str):
 
 @app.post("/api/regenerate/{job_id}/{item_id}")
 async def regenerate(job_id: str, item_id: str, background_tasks: BackgroundTasks, payload: dict = {}):
-    job = JOBS.get(job_id)
+    job = await job_store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     # find item
@@ -151,11 +206,52 @@ async def regenerate(job_id: str, item_id: str, background_tasks: BackgroundTask
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     item_text = payload.get("text") or item.get("text")
-    item["status"] = "pending"
-    background_tasks.add_task(enqueue_generation, job_id, item_id, item_text, payload.get("options", {}))
+    await job_store.patch_item(job_id, item_id, {"status": "pending"})
+    options = {**payload.get("options", {}), "force": True}
+    background_tasks.add_task(enqueue_generation, job_id, item_id, item_text, options)
     return {"ok": True}
 
 
+# (cache path, api key) -> in-flight generation task, so duplicate prompts share one
+# provider call; callers with a different key never wait on (or inherit) another's result
+_INFLIGHT_IMAGES = {}
+# cache path -> background write of a generated image not yet on disk
+_PENDING_WRITES = {}
+
+
+def _forget_task(registry: dict, key, task: asyncio.Task):
+    # done callback: drop `task` only if it is still the registered one; an overlapping
+    # (e.g. forced) generation of the same path may have replaced it meanwhile
+    if registry.get(key) is task:
+        del registry[key]
+
+
+async def _persist(path: Path, img_bytes: bytes):
+    # temp file + rename so other workers never see a partially written image
+    try:
+        await asyncio.to_thread(atomic_write_bytes, path, img_bytes)
+    except Exception:
+        logger.exception("Failed to write generated image %s", path.name)
+
+
+async def _generate_to_cache(path: Path, prompt: str, gen_opts: dict) -> str:
+    """Generate `prompt` and return the cache filename to serve.
+
+    Only real provider output is stored at `path`. A placeholder (provider error,
+    rate limit, missing token) goes under its own name, so the next request retries.
+    """
+    # provider calls are bounded process-wide inside remote_generate_image
+    img_bytes, ok = await remote_generate_image(prompt, gen_opts)
+    if not ok:
+        path = IMAGE_CACHE / placeholder_filename(prompt)
+    # the response only needs the URL; write to disk off the critical path
+    # (serve_image waits for a pending write before serving the file)
+    task = asyncio.create_task(_persist(path, img_bytes))
+    _PENDING_WRITES[path] = task
+    task.add_done_callback(functools.partial(_forget_task, _PENDING_WRITES, path))
+    return path.name
+
+
 @app.post("/api/generate_images")
 async def generate_images(payload: dict):
     """Generate images immediately for given items. Body: { items: [{id, text}], options: {...} }
@@ -167,24 +263,21 @@ async def generate_images(payload: dict):
     if not isinstance(items, list):
         raise HTTPException(status_code=400, detail="`items` must be a list")
 
-    # server env fallbacks
-    import os as _os
-    server_hf = _os.getenv('HF_TOKEN') or _os.getenv('HUGGINGFACE_API_KEY') or _os.getenv('HUGGINGFACE_TOKEN')
-    server_openai = _os.getenv('OPENAI_API_KEY') or _os.getenv('OPENAI_APIKEY')
-
     # LLM options (support both generic and llm-prefixed keys)
     use_llm = bool(options.get('use_llm') or options.get('llm_use'))
-    llm_api_key = options.get('api_key') or options.get('llm_api_key') or server_hf or server_openai
+    llm_api_key = options.get('api_key') or options.get('llm_api_key') or SERVER_HF or SERVER_OPENAI
     llm_provider = options.get('provider') or options.get('llm_provider') or 'huggingface'
     llm_model = options.get('model') or options.get('llm_model')
 
     # Image generation options (support image-prefixed and generic keys)
     image_provider = options.get('image_provider') or options.get('provider') or 'nebius'
-    image_api_key = options.get('image_api_key') or options.get('image_key') or server_hf or server_openai
+    image_api_key = options.get('image_api_key') or options.get('image_key') or SERVER_HF or SERVER_OPENAI
     image_model = options.get('image_model') or options.get('image_model') or 'black-forest-labs/FLUX.1-dev'
     hf_provider = options.get('hf_provider') or options.get('image_hf_provider') or 'nebius'
+    force = bool(options.get('force'))
 
-    names = [it.get("text") or it.get("name") for it in items]
+    # coalesce repeated names so each dish is described/prompted once
+    names = list(dict.fromkeys(it.get("text") or it.get("name") for it in items))
     prompts = {}
     if use_llm:
         if not llm_api_key:
@@ -194,46 +287,65 @@ async def generate_images(payload: dict):
             for d in descr:
                 prompts[d['name']] = d.get('prompt')
         except Exception:
-            for n in names:
-                prompts[n] = f"Photorealistic food photography of {n}, plated, high detail, natural lighting, shallow depth of field, appetizing"
-    else:
-        for n in names:
-            prompts[n] = f"Photorealistic food photography of {n}, plated, high detail, natural lighting, shallow depth of field, appetizing"
+            # items without an LLM prompt use the default prompt below
+            pass
 
-    results = {}
-    # generate synchronously for prototype
-    for it in items:
+    gen_opts = {
+        'provider': image_provider,
+        'api_key': image_api_key,
+        'model': image_model,
+        'hf_provider': hf_provider,
+    }
+    # generate concurrently; the provider rate limit is enforced by generator's
+    # process-wide semaphore, shared with confirmed jobs
+    async def _one(it):
         item_id = it.get('id') or str(hash(it.get('text')))
         name = it.get('text') or it.get('name')
-        prompt = it.get('prompt') or options.get('prompt') or prompts.get(name)
-        gen_opts = {
-            'provider': image_provider,
-            'api_key': image_api_key,
-            'model': image_model,
-            'hf_provider': hf_provider,
-        }
+        prompt = (
+            it.get('prompt') or options.get('prompt') or prompts.get(name)
+            or f"Photorealistic food photography of {name}, plated, high detail, natural lighting, shallow depth of field, appetizing"
+        )
         try:
-            img_bytes = await remote_generate_image(prompt, gen_opts)
-            # save
-            import hashlib
-            h = hashlib.sha256((name + prompt).encode('utf-8')).hexdigest()
-            filename = f"{h}.jpg"
-            path = IMAGE_CACHE / filename
-            async with aiofiles.open(path, 'wb') as f:
-                await f.write(img_bytes)
-            results[item_id] = {'status': 'ok', 'image': '/api/image/' + filename}
+            path = cached_path(image_provider, hf_provider, image_model, prompt)
+            # same prompt/provider/model was generated before: serve it without a provider call
+            # (options.force asks for a fresh image, as /api/regenerate does)
+            if not force and (path in _PENDING_WRITES or path.exists()):
+                filename = path.name
+            else:
+                # items (in this or a concurrent request) sharing a prompt and key wait on one generation
+                key = (path, image_api_key)
+                task = _INFLIGHT_IMAGES.get(key)
+                if task is None:
+                    task = asyncio.create_task(_generate_to_cache(path, prompt, gen_opts))
+                    _INFLIGHT_IMAGES[key] = task
+                    task.add_done_callback(functools.partial(_forget_task, _INFLIGHT_IMAGES, key))
+                # shield so one cancelled request does not cancel the shared generation
+                filename = await asyncio.shield(task)
+            return item_id, {'status': 'ok', 'image': '/api/image/' + filename}
         except Exception as e:
-            results[item_id] = {'status': 'error', 'error': str(e)}
+            return item_id, {'status': 'error', 'error': str(e)}
 
+    results = dict(await asyncio.gather(*(_one(it) for it in items)))
     return {'results': results}
 
 @app.get("/api/image/{image_hash}")
-async def serve_image(image_hash: str):
+async def serve_image(image_hash: str, request: Request):
     # serve cached images
     path = IMAGE_CACHE / image_hash
-    if not path.exists():
+    pending = _PENDING_WRITES.get(path)
+    if pending is not None:
+        await asyncio.shield(pending)
+    if not path.is_file():
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(path)
+    st = path.stat()
+    # regenerate can overwrite a file in place, so the ETag includes its mtime and
+    # browsers revalidate (cheap 304) instead of caching forever
+    etag = f'"{path.stem}-{st.st_mtime_ns:x}"'
+    headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (t.strip().removeprefix("W/") for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/jpeg", headers=headers, stat_result=st)
 
 
 if __name__ == "__main__":
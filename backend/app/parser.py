@@ -1,7 +1,9 @@
 import re
 from typing import List, Dict
 
-CURRENCY_RE = re.compile(r"[\$£€]\s*\d+|\d+\s*(?:USD|EUR|GBP)")
+# Prices ("$12", "10 USD") and calorie counts ("120 kcal") in one pattern so each
+# line is cleaned in a single pass
+CURRENCY_RE = re.compile(r"[\$£€]\s*\d+|\d+\s*(?:USD|EUR|GBP|k?cal)\b", re.IGNORECASE)
 
 def strip_price(s: str) -> str:
     return CURRENCY_RE.sub("", s).strip()
@@ -14,19 +16,16 @@ def parse_lines(lines: List[str]) -> List[Dict]:
         # remove lines that are too short or look like prices
         if len(line) < 2:
             continue
-        if CURRENCY_RE.search(line):
-            # possibly "Pizza Margherita 12.99" -> split and keep left side
-            cleaned = strip_price(line)
-            if cleaned:
-                line = cleaned
-            else:
+        # possibly "Pizza Margherita 12.99" -> keep left side; subn tells us if anything matched
+        cleaned, n = CURRENCY_RE.subn("", line)
+        if n:
+            line = cleaned.strip()
+            if not line:
                 continue
-        # remove lines with too many commas (likely descriptions) but keep title-like
-        candidate = line
         # dedupe
-        key = candidate.lower()
+        key = line.casefold()
         if key in seen:
             continue
         seen.add(key)
-        items.append({"id": str(i), "text": candidate})
+        items.append({"id": str(i), "text": line})
     return items